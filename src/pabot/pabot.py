@@ -27,6 +27,7 @@ Copyright 2022 Mikko Korpela - Apache 2 License
 
 from __future__ import absolute_import, print_function
 
+import bisect
 import datetime
 import hashlib
 import os
@@ -108,6 +109,7 @@ _NUMBER_OF_ITEMS_TO_BE_EXECUTED = 0
 _ABNORMAL_EXIT_HAPPENED = False
 
 _COMPLETED_LOCK = threading.Lock()
+# Sorted, so the lowest index still executing is always the first one
 _NOT_COMPLETED_INDEXES = []  # type: List[int]
 
 _ROBOT_EXTENSIONS = [
@@ -121,6 +123,7 @@ _ROBOT_EXTENSIONS = [
     ".robot",
 ]
 _ALL_ELAPSED = []  # type: List[Union[int, float]]
+_TERMINATE_GRACE_SECONDS = 5  # documented with --processtimeout in README.md
 
 
 def extract_section(filename, start_marker, end_marker):
@@ -436,9 +439,13 @@ def _increase_completed(plib, my_index):
     # type: (Remote, int) -> None
     global _COMPLETED_LOCK, _NOT_COMPLETED_INDEXES
     with _COMPLETED_LOCK:
-        if my_index not in _NOT_COMPLETED_INDEXES:
+        position = bisect.bisect_left(_NOT_COMPLETED_INDEXES, my_index)
+        if (
+            position == len(_NOT_COMPLETED_INDEXES)
+            or _NOT_COMPLETED_INDEXES[position] != my_index
+        ):
             return
-        _NOT_COMPLETED_INDEXES.remove(my_index)
+        del _NOT_COMPLETED_INDEXES[position]
         if _NOT_COMPLETED_INDEXES:
             plib.run_keyword(
                 "set_parallel_value_for_key",
@@ -472,9 +479,11 @@ def _run(
         cmd = cmd.decode("utf-8").encode(SYSTEM_ENCODING)
     # avoid hitting https://bugs.python.org/issue10394
     with POPEN_LOCK:
-        my_env = os.environ.copy()
-        syslog_file = my_env.get("ROBOT_SYSLOG_FILE", None)
+        # None inherits the environment, copied only when it must change
+        my_env = None
+        syslog_file = os.environ.get("ROBOT_SYSLOG_FILE", None)
         if syslog_file:
+            my_env = os.environ.copy()
             my_env["ROBOT_SYSLOG_FILE"] = os.path.join(
                 outs_dir, os.path.basename(syslog_file)
             )
@@ -502,18 +511,33 @@ def _run(
     )
 
 
+def _wait_for_exit(process, exited):
+    process.wait()
+    exited.set()
+
+
 def _wait_for_return_code(process, item_name, pool_id, item_index, process_timeout):
-    rc = None
-    elapsed = 0
-    ping_time = ping_interval = 150
-    while rc is None:
-        rc = process.poll()
-        time.sleep(0.1)
-        elapsed += 1
+    start = time.monotonic()
+    # Popen.wait with a timeout polls, a plain wait blocks until the exit
+    exited = threading.Event()
+    threading.Thread(target=_wait_for_exit, args=(process, exited), daemon=True).start()
+    ping_time = ping_interval = 15.0
+    while True:
+        # Woken up by the process exiting or by the next ping or timeout
+        wake_up = ping_time
+        if process_timeout and process_timeout < wake_up:
+            wake_up = process_timeout
+        if exited.wait(timeout=max(start + wake_up - time.monotonic(), 0)):
+            rc = process.returncode
+            break
+        elapsed = time.monotonic() - start
 
-        if process_timeout and elapsed / 10.0 >= process_timeout:
+        if process_timeout and elapsed >= process_timeout:
             process.terminate()
-            process.wait()
+            if not exited.wait(timeout=_TERMINATE_GRACE_SECONDS):
+                # Did not stop gracefully, e.g. a hanging keyword
+                process.kill()
+                exited.wait()
             rc = (
                 -1
             )  # Set a return code indicating that the process was killed due to timeout
@@ -526,17 +550,17 @@ def _wait_for_return_code(process, item_name, pool_id, item_index, process_timeo
             )
             break
 
-        if elapsed == ping_time:
-            ping_interval += 50
-            ping_time += ping_interval
+        if elapsed >= ping_time:
             _write_with_id(
                 process,
                 pool_id,
                 item_index,
-                "still running %s after %s seconds" % (item_name, elapsed / 10.0),
+                "still running %s after %s seconds" % (item_name, ping_time),
             )
+            ping_interval += 5.0
+            ping_time += ping_interval
 
-    return rc, elapsed / 10.0
+    return rc, round(time.monotonic() - start, 1)
 
 
 def _read_file(file_handle):
@@ -1544,13 +1568,23 @@ def _glob_escape(pathname):
 
 def _writer():
     while True:
-        message = MESSAGE_QUEUE.get()
-        if message is None:
+        messages = [MESSAGE_QUEUE.get()]
+        # Messages queued in the meantime are printed with a single flush
+        while messages[-1] is not None:
+            try:
+                messages.append(MESSAGE_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        stop = messages[-1] is None
+        if stop:
+            messages.pop()
+        if messages:
+            print(*messages, sep="\n")
+            sys.stdout.flush()
+        for _ in range(len(messages) + stop):
             MESSAGE_QUEUE.task_done()
+        if stop:
             return
-        print(message)
-        sys.stdout.flush()
-        MESSAGE_QUEUE.task_done()
 
 
 def _write(message, color=None):
@@ -1558,7 +1592,7 @@ def _write(message, color=None):
 
 
 def _wrap_with(color, message):
-    if _is_output_coloring_supported() and color:
+    if color and _is_output_coloring_supported():
         return "%s%s%s" % (color, message, Color.ENDC)
     return message
 
@@ -1719,7 +1753,7 @@ def _construct_index_and_completed_index(all_items):
     with _COMPLETED_LOCK:
         for item_group in all_items:
             for item in item_group:
-                _NOT_COMPLETED_INDEXES.append(item.index)
+                bisect.insort(_NOT_COMPLETED_INDEXES, item.index)
 
 
 def _create_execution_items_for_run(
@@ -1885,7 +1919,7 @@ def _get_dynamically_created_execution_items(
     with _COMPLETED_LOCK:
         _NUMBER_OF_ITEMS_TO_BE_EXECUTED += len(items)
         for item in items:
-            _NOT_COMPLETED_INDEXES.append(item.index)
+            bisect.insort(_NOT_COMPLETED_INDEXES, item.index)
     return items
 
 
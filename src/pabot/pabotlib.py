@@ -24,9 +24,10 @@ except:
 
     # Support Python 2
 
+import sys
 import threading
 import time
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from robot.api import logger
 from robot.libraries.BuiltIn import BuiltIn
@@ -41,6 +42,21 @@ PABOT_QUEUE_INDEX = "PABOTQUEUEINDEX"
 PABOT_LAST_EXECUTION_IN_POOL = "PABOTISLASTEXECUTIONINPOOL"
 PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE = "pabot_min_queue_index_executing"
 
+_FIRST_POLLING_SECONDS = 0.005
+
+
+def _polling_intervals(max_seconds):  # type: (float) -> Iterator[float]
+    # Exponential backoff: react fast to short waits, poll at most every
+    # max_seconds on long ones.
+    seconds = min(_FIRST_POLLING_SECONDS, max_seconds)
+    while True:
+        yield seconds
+        seconds = min(seconds * 2, max_seconds)
+
+
+def _split_tags(tags):  # type: (str) -> Tuple[str, ...]
+    return tuple(sys.intern(t) for t in map(str.strip, tags.split(",")))
+
 
 class _PabotLib(object):
     _TAGS_KEY = "tags"
@@ -65,16 +81,14 @@ class _PabotLib(object):
         conf = configparser.ConfigParser()
         conf.read(resourcefile)
         for section in conf.sections():
-            vals[section] = dict(
-                (k, conf.get(section, k)) for k in conf.options(section)
+            values = dict(
+                (sys.intern(k), conf.get(section, k)) for k in conf.options(section)
             )
-        for section in vals:
-            if self._TAGS_KEY in vals[section]:
-                vals[section][self._TAGS_KEY] = [
-                    t.strip() for t in vals[section][self._TAGS_KEY].split(",")
-                ]
+            if self._TAGS_KEY in values:
+                values[self._TAGS_KEY] = _split_tags(values[self._TAGS_KEY])
             else:
-                vals[section][self._TAGS_KEY] = []
+                values[self._TAGS_KEY] = ()
+            vals[section] = values
         return vals
 
     def set_parallel_value_for_key(self, key, value):  # type: (str, object) -> None
@@ -97,6 +111,23 @@ class _PabotLib(object):
         if self._locks[name][1] == 0:
             del self._locks[name]
 
+    def _try_run_once_lock(self, name, caller_id):
+        # type: (str, str) -> Tuple[bool, object]
+        # Lock and the stored result in one call. If some other process has
+        # already stored a result the lock is not kept. Not a keyword, only
+        # called through _run_with_lib.
+        if not _PabotLib.acquire_lock(self, name, caller_id):
+            return False, ""
+        passed = _PabotLib.get_parallel_value_for_key(self, name)
+        if passed != "":
+            _PabotLib.release_lock(self, name, caller_id)
+        return True, passed
+
+    def _release_run_once_lock(self, name, caller_id, status):
+        # type: (str, str, str) -> None
+        _PabotLib.set_parallel_value_for_key(self, name, status)
+        _PabotLib.release_lock(self, name, caller_id)
+
     def release_locks(self, caller_id):
         # type: (str) -> None
         for key in list(self._locks.keys()):
@@ -146,12 +177,12 @@ class _PabotLib(object):
         return self._owner_to_values[caller_id][key]
 
     def add_value_to_set(self, name, content):
+        # Same key normalization as configparser does for resource files
+        content = dict((sys.intern(k.lower()), v) for k, v in content.items())
         if self._TAGS_KEY in content.keys():
-            content[self._TAGS_KEY] = [
-                t.strip() for t in content[self._TAGS_KEY].split(",")
-            ]
+            content[self._TAGS_KEY] = _split_tags(content[self._TAGS_KEY])
         if self._TAGS_KEY not in content.keys():
-            content[self._TAGS_KEY] = []
+            content[self._TAGS_KEY] = ()
         self._values[name] = content
 
     def import_shared_library(
@@ -213,24 +244,25 @@ class PabotLib(_PabotLib):
         self._valueset = None
         self._setname = None
         self.ROBOT_LIBRARY_LISTENER = self
-        self._position = []  # type: List[str]
+        # Suite and test entries are long names. Keyword entries are only
+        # their row index, the dotted path is built when _path is read.
+        self._position = []  # type: List[Union[str, int]]
         self._row_index = 0
 
     def _start(self, name, attributes):
         self._position.append(attributes["longname"])
 
     def _end(self, name, attributes):
-        self._position = (
-            self._position[:-1]
-            if len(self._position) > 1
-            else [attributes["longname"][: -len(name) - 1]]
-        )
+        if len(self._position) > 1:
+            self._position.pop()
+        else:
+            self._position = [attributes["longname"][: -len(name) - 1]]
 
     def _start_keyword(self, name, attributes):
         if not (self._position):
-            self._position = ["0", "0." + str(self._row_index)]
+            self._position = ["0", self._row_index]
         else:
-            self._position.append(self._position[-1] + "." + str(self._row_index))
+            self._position.append(self._row_index)
         self._row_index = 0
 
     def _end_keyword(self, name, attributes):
@@ -238,14 +270,18 @@ class PabotLib(_PabotLib):
             self._row_index = 1
             self._position = ["0"]
             return
-        splitted = self._position[-1].split(".")
+        last = self._position[-1]
+        if isinstance(last, int):
+            self._row_index = last + 1
+            self._position.pop()
+            return
+        splitted = last.split(".")
         self._row_index = int(splitted[-1]) if len(splitted) > 1 else 0
         self._row_index += 1
-        self._position = (
-            self._position[:-1]
-            if len(self._position) > 1
-            else [str(int(splitted[0]) + 1)]
-        )
+        if len(self._position) > 1:
+            self._position.pop()
+        else:
+            self._position = [str(int(splitted[0]) + 1)]
 
     _start_suite = _start_test = _start
     _end_suite = _end_test = _end
@@ -269,7 +305,14 @@ class PabotLib(_PabotLib):
     def _path(self):
         if len(self._position) < 1:
             return ""
-        return self._position[-1]
+        parts = []
+        for entry in reversed(self._position):
+            if isinstance(entry, int):
+                parts.append(str(entry))
+            else:
+                parts.append(entry)
+                break
+        return ".".join(reversed(parts))
 
     @property
     def _my_id(self):
@@ -289,13 +332,13 @@ class PabotLib(_PabotLib):
 
     def set_polling_seconds(self, secs):
         """
-        Determine the amount of seconds to wait between checking for free locks. Default: 0.1  (100ms)
+        Determine the maximum amount of seconds to wait between checking for free locks. Default: 0.1  (100ms)
         """
         PabotLib._pollingSeconds = secs
 
     def set_polling_seconds_setupteardown(self, secs):
         """
-        Determine the amount of seconds to wait between checking for free locks during setup and teardown. Default: 0.3  (300ms)
+        Determine the maximum amount of seconds to wait between checking for free locks during setup and teardown. Default: 0.3  (300ms)
         """
         PabotLib._pollingSeconds_SetupTeardown = secs
 
@@ -316,21 +359,18 @@ class PabotLib(_PabotLib):
         if self._execution_ignored:
             return
         lock_name = "pabot_setup_%s" % self._path
+        passed = self._acquire_run_once_lock(lock_name)
+        if passed != "":
+            if passed == "FAILED":
+                raise AssertionError("Setup failed in other process")
+            logger.info("Setup skipped in this item")
+            return
+        status = "FAILED"
         try:
-            self.acquire_lock(lock_name)
-            passed = self.get_parallel_value_for_key(lock_name)
-            if passed != "":
-                if passed == "FAILED":
-                    raise AssertionError("Setup failed in other process")
-                logger.info("Setup skipped in this item")
-                return
             BuiltIn().run_keyword(keyword, *args)
-            self.set_parallel_value_for_key(lock_name, "PASSED")
-        except:
-            self.set_parallel_value_for_key(lock_name, "FAILED")
-            raise
+            status = "PASSED"
         finally:
-            self.release_lock(lock_name)
+            self._run_with_lib("_release_run_once_lock", lock_name, self._my_id, status)
 
     def run_only_once(self, keyword, *args):
         """
@@ -343,21 +383,30 @@ class PabotLib(_PabotLib):
         if self._execution_ignored:
             return
         lock_name = "pabot_run_only_once_%s_%s" % (keyword, str(args))
+        passed = self._acquire_run_once_lock(lock_name)
+        if passed != "":
+            if passed == "FAILED":
+                raise AssertionError("Keyword failed in other process")
+            logger.info("Skipped in this item")
+            return
+        status = "FAILED"
         try:
-            self.acquire_lock(lock_name)
-            passed = self.get_parallel_value_for_key(lock_name)
-            if passed != "":
-                if passed == "FAILED":
-                    raise AssertionError("Keyword failed in other process")
-                logger.info("Skipped in this item")
-                return
             BuiltIn().run_keyword(keyword, *args)
-            self.set_parallel_value_for_key(lock_name, "PASSED")
-        except:
-            self.set_parallel_value_for_key(lock_name, "FAILED")
-            raise
+            status = "PASSED"
         finally:
-            self.release_lock(lock_name)
+            self._run_with_lib("_release_run_once_lock", lock_name, self._my_id, status)
+
+    def _acquire_run_once_lock(self, name):
+        intervals = _polling_intervals(PabotLib._pollingSeconds)
+        while True:
+            acquired, passed = self._run_with_lib(
+                "_try_run_once_lock", name, self._my_id
+            )
+            if acquired:
+                return passed
+            time.sleep(next(intervals))
+            if PabotLib._polling_logging:
+                logger.debug("waiting for lock to release")
 
     def run_teardown_only_once(self, keyword, *args):
         """
@@ -379,6 +428,7 @@ class PabotLib(_PabotLib):
         )
         logger.trace("Queue index (%d)" % queue_index)
         if self._remotelib:
+            intervals = _polling_intervals(PabotLib._pollingSeconds_SetupTeardown)
             while (
                 self.get_parallel_value_for_key(
                     PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE
@@ -391,7 +441,7 @@ class PabotLib(_PabotLib):
                             PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE
                         )
                     )
-                time.sleep(PabotLib._pollingSeconds_SetupTeardown)
+                time.sleep(next(intervals))
         logger.trace("Teardown conditions met. Executing keyword.")
         BuiltIn().run_keyword(keyword, *args)
 
@@ -416,8 +466,9 @@ class PabotLib(_PabotLib):
             BuiltIn().get_variable_value("${%s}" % PABOT_QUEUE_INDEX) or 0
         )
         if queue_index > 0 and self._remotelib:
+            intervals = _polling_intervals(PabotLib._pollingSeconds_SetupTeardown)
             while self.get_parallel_value_for_key("pabot_only_last_executing") != 1:
-                time.sleep(PabotLib._pollingSeconds_SetupTeardown)
+                time.sleep(next(intervals))
         BuiltIn().run_keyword(keyword)
 
     def set_parallel_value_for_key(self, key, value):
@@ -460,10 +511,11 @@ class PabotLib(_PabotLib):
         """
         if self._remotelib:
             try:
+                intervals = _polling_intervals(PabotLib._pollingSeconds)
                 while not self._remotelib.run_keyword(
                     "acquire_lock", [name, self._my_id], {}
                 ):
-                    time.sleep(PabotLib._pollingSeconds)
+                    time.sleep(next(intervals))
                     if PabotLib._polling_logging:
                         logger.debug("waiting for lock to release")
                 return True
@@ -504,6 +556,7 @@ class PabotLib(_PabotLib):
     def _acquire_value_set(self, *tags):
         if self._remotelib:
             try:
+                intervals = _polling_intervals(PabotLib._pollingSeconds)
                 while True:
                     self._setname, self._valueset = self._remotelib.run_keyword(
                         "acquire_value_set", [self._my_id] + list(tags), {}
@@ -511,7 +564,7 @@ class PabotLib(_PabotLib):
                     if self._setname:
                         logger.info('Value set "%s" acquired' % self._setname)
                         return self._setname
-                    time.sleep(PabotLib._pollingSeconds)
+                    time.sleep(next(intervals))
                     if PabotLib._polling_logging:
                         logger.debug("waiting for a value set")
             except RuntimeError as err:
@@ -571,8 +624,6 @@ class PabotLib(_PabotLib):
 pabotlib = PabotLib
 
 if __name__ == "__main__":
-    import sys
-
     RobotRemoteServer(
         _PabotLib(sys.argv[1]), host=sys.argv[2], port=sys.argv[3], allow_stop=True
     )
@@ -1,4 +1,4 @@
-import os
+import io
 import socket
 import tarfile
 
@@ -12,22 +12,27 @@ def make_order(hive: str, order: str, outputdir: str):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(None)
     try:
+        messages.set_buffer_sizes(sock)
         # Connect to server and send data
         sock.connect((HOST, PORT))
-        messages.put_message(sock, messages.REGISTER_CLIENT, "")
+        messages.set_nodelay(sock)
         print(repr(order))
-        messages.put_message(sock, messages.REQUEST_TO_RUN, order)
-        data = messages.get_bytes(sock)
-        curdir = os.getcwd()
-        os.chdir(outputdir)
-        with open("Tardistan.tar.gz", "wb") as outputs:
-            outputs.write(data[1:])
-        tar = tarfile.open("Tardistan.tar.gz")
-        tar.extractall()
-        tar.close()
-        os.remove("Tardistan.tar.gz")
+        messages.put_messages(
+            sock,
+            [(messages.REGISTER_CLIENT, ""), (messages.REQUEST_TO_RUN, order)],
+        )
+        result = io.BytesIO()
+        while "receiving":
+            data = messages.get_bytes(sock)
+            if not data or data[0] == messages.WORK_RESULT_END:
+                break
+            result.write(memoryview(data)[1:])
+            if data[0] == messages.WORK_RESULT:
+                break
+        result.seek(0)
+        with tarfile.open(fileobj=result, mode="r:gz") as tar:
+            tar.extractall(path=outputdir)
         print(f"Received result")
-        os.chdir(curdir)
     finally:
         sock.close()
 
@@ -1,62 +1,123 @@
-import socketserver
-from queue import Queue
-from typing import Dict, Set
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, Optional, Set, Tuple
 
 from . import messages
 
-workers: Queue = Queue()
-clients: Set["CoordinatorHandler"] = set()
-work_to_client: Dict["CoordinatorHandler", "CoordinatorHandler"] = dict()
-
-
-class CoordinatorHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        try:
-            while "connected":
-                msg = messages.get_message(self.request)
-                if msg.type == messages.CONNECTION_END:
-                    return
-                if messages.REGISTER_WORKER == msg.type:
-                    print(f"Received registeration from worker")
-                    workers.put(self)
-                if messages.REGISTER_CLIENT == msg.type:
-                    print(f"Received registeration from client")
-                    clients.add(self)
-                if self in clients and messages.REQUEST_TO_RUN == msg.type:
-                    print("Request from client")
-                    w = workers.get()
-                    print("Sending to worker")
-                    messages.put_message(w.request, messages.WORK, msg.data)
-                    work_to_client[w] = self
-                    continue
-                elif messages.WORK_RESULT == msg.type:
-                    print(f"Received work results!")
-                    # FIXME: Forward this direclty instead of unwrapping and wrapping
-                    msg.forward_to(work_to_client[self].request)
-                    del work_to_client[self]
-                    workers.put(self)
-                    # print("Closing connection")
-                    # messages.put_message(self.request, messages.CONNECTION_END, '')
-                    # return
-                elif messages.LOG == msg.type:
-                    print(f"Received log '{msg.data}'")
-                msg.flush()
-        finally:
-            if self in clients:
-                clients.remove(self)
-            print("Closed connection")
-
-
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+workers: Optional["asyncio.Queue[asyncio.StreamWriter]"] = None
+clients: Set[asyncio.StreamWriter] = set()
+work_to_client: Dict[asyncio.StreamWriter, asyncio.StreamWriter] = dict()
+
+FORWARD_CHUNK_SIZE = 64 * 1024
+
+log = logging.getLogger(__name__)
+
+
+async def read_header(reader: asyncio.StreamReader) -> Tuple[bytes, int, int]:
+    header = await reader.readexactly(messages.format.size + 1)
+    (length,) = messages.format.unpack(header[: messages.format.size])
+    return header, length, header[messages.format.size]
+
+
+async def forward(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, length: int
+):
+    while length > 0:
+        data = await reader.read(min(length, FORWARD_CHUNK_SIZE))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", length)
+        writer.write(data)
+        await writer.drain()
+        length -= len(data)
+
+
+async def next_worker() -> asyncio.StreamWriter:
+    assert workers is not None
+    while "searching":
+        w = await workers.get()
+        # Workers that disconnected while idle are still in the queue
+        if not w.transport.is_closing():
+            return w
+
+
+async def coordinate(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    assert workers is not None
+    try:
+        while "connected":
+            try:
+                header, length, msg_type = await read_header(reader)
+            except asyncio.IncompleteReadError:
+                return
+            if msg_type == messages.CONNECTION_END:
+                return
+            if messages.REGISTER_WORKER == msg_type:
+                log.debug("Received registeration from worker")
+                await workers.put(writer)
+            if messages.REGISTER_CLIENT == msg_type:
+                log.debug("Received registeration from client")
+                clients.add(writer)
+            if writer in clients and messages.REQUEST_TO_RUN == msg_type:
+                log.debug("Request from client")
+                data = await reader.readexactly(length - 1)
+                w = await next_worker()
+                log.debug("Sending to worker")
+                # The command is passed on as is, only the type byte changes
+                w.write(messages.format.pack(length) + messages.TAGS[messages.WORK])
+                w.write(data)
+                await w.drain()
+                work_to_client[w] = writer
+                continue
+            elif msg_type in (
+                messages.WORK_RESULT,
+                messages.WORK_RESULT_CHUNK,
+                messages.WORK_RESULT_END,
+            ):
+                log.debug("Received work results")
+                client = work_to_client[writer]
+                # Same frame for the client, so the header goes on unchanged
+                client.write(header)
+                await forward(reader, client, length - 1)
+                if msg_type != messages.WORK_RESULT_CHUNK:
+                    del work_to_client[writer]
+                    await workers.put(writer)
+                continue
+            data = await reader.readexactly(length - 1)
+            if messages.LOG == msg_type and log.isEnabledFor(logging.DEBUG):
+                log.debug("Received log %s", str(data, "utf-8", "replace"))
+    finally:
+        clients.discard(writer)
+        client = work_to_client.pop(writer, None)
+        if client is not None:
+            # Worker went away in the middle of a run, do not leave the
+            # client waiting for a result that never comes
+            client.close()
+        writer.close()
+        log.debug("Closed connection")
 
 
 def main(args=None):
+    global workers
     HOST, PORT = "0.0.0.0", 8765
-    server = ThreadedTCPServer((HOST, PORT), CoordinatorHandler)
-    server.timeout = None
-    print(f"Starting Coordinator server at {HOST}:{PORT}")
-    server.serve_forever()
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    workers = asyncio.Queue()
+    # Buffer sizes are set before listening, accepted connections inherit them
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if os.name == "posix":  # Same as asyncio, elsewhere it allows port sharing
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    messages.set_buffer_sizes(sock)
+    sock.bind((HOST, PORT))
+    server = loop.run_until_complete(asyncio.start_server(coordinate, sock=sock))
+    log.info("Starting Coordinator server at %s:%s", HOST, PORT)
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
+import socket
 import struct
-from typing import Optional
+from typing import List, Optional, Tuple
 
 CONNECTION_END = 0
 REGISTER_CLIENT = 1
@@ -8,25 +9,51 @@ REGISTER_WORKER = 3
 WORK = 4
 WORK_RESULT = 5
 LOG = 6
+WORK_RESULT_CHUNK = 7
+WORK_RESULT_END = 8
 
-format = struct.Struct("!I")  # for messages up to 2**32 - 1 in length
-
+# Type bytes ready to be sent, indexed by message type
+TAGS = tuple(bytes([msg_type]) for msg_type in range(256))
 
-def recvall(sock, length: int) -> bytes:
-    data = b""
-    while len(data) < length:
-        more = sock.recv(length - len(data))
+format = struct.Struct("!I")  # for messages up to 2**32 - 1 in length
+_PACK = format.pack
+_UNPACK = format.unpack
+_UNPACK_FROM = format.unpack_from
+_HDR_SIZE = format.size
+
+RESULT_CHUNK_SIZE = 64 * 1024
+SOCKET_BUFFER_SIZE = 1 << 20
+
+
+def set_nodelay(sock):
+    # Frames are complete messages, waiting for more data only adds latency
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def set_buffer_sizes(sock):
+    # Room for bulk results in flight. Must be set before connect or listen
+    # for the receive window to scale up.
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+
+
+def recvall(sock, length: int, buffer: Optional[bytearray] = None):
+    # Receive straight into a buffer of the announced size. With a reusable
+    # buffer the result is a memoryview into it, valid until the next call.
+    if buffer is None:
+        data = bytearray(length)
+    else:
+        if len(buffer) < length:
+            buffer.extend(bytes((1 << (length - 1).bit_length()) - len(buffer)))
+        data = buffer
+    view = memoryview(data)[:length]
+    received = 0
+    while received < length:
+        more = sock.recv_into(view[received:], length - received)
         if not more:
             return b""
-        data += more
-    return data
-
-
-def forward_vall(sock_from, sock_to, length: int):
-    while length > 0:
-        data = sock_from.recv(length)
-        sock_to.send(data)
-        length -= len(data)
+        received += more
+    return data if buffer is None else view
 
 
 def get(sock) -> str:
@@ -37,54 +64,82 @@ class Message:
     _type: Optional[int]
     _length: int
     _data: Optional[str]
-    _forwarded: bool
 
-    def __init__(self, sock):
+    def __init__(self, sock, buffer: Optional[bytearray] = None):
         self._socket = sock
+        self._buffer = buffer
         self._length = 0
         self._data = None
-        self._forwarded = False
         self._type = None
 
     @property
     def type(self):
-        if not self._type:
-            lendata = recvall(self._socket, format.size)
-            if not lendata:
+        if self._type is None:
+            # Length and type byte are read in one go
+            header = recvall(self._socket, _HDR_SIZE + 1)
+            if not header:
                 self._type = CONNECTION_END
                 return self._type
-            (self._length,) = format.unpack(lendata)
-            self._type = int(recvall(self._socket, 1)[0])
+            (self._length,) = _UNPACK_FROM(header)
+            self._type = header[_HDR_SIZE]
         return self._type
 
     @property
     def data(self):
         if self._data is None:
             self.type  # Ensure type byte has been processed
-            self._data = str(recvall(self._socket, self._length - 1), "utf-8")
+            data = recvall(self._socket, self._length - 1, self._buffer)
+            self._data = str(data, "utf-8")
+            if isinstance(data, memoryview):
+                data.release()
         return self._data
 
-    def forward_to(self, receiver):
-        if self._data is None:
-            receiver.send(format.pack(self._length) + bytes([self.type]))
-            forward_vall(self._socket, receiver, self._length - 1)
-        else:
-            put_bytes(receiver, bytes([self.type]) + bytes(self._data, "utf-8"))
-        self._forwarded = True
-
     def flush(self):
         # Ensure that all bytes have been processed
-        self.type
-        if not self._forwarded:
-            self.data
+        self.data
+
+
+def get_message(sock, buffer: Optional[bytearray] = None) -> Message:
+    return Message(sock, buffer)
 
 
-def get_message(sock) -> Message:
-    return Message(sock)
+def _frame(bytes_msg: bytes) -> bytes:
+    return _PACK(len(bytes_msg)) + bytes_msg
+
+
+def frame_message(msg_type: int, message: str) -> bytes:
+    if not message:
+        return _EMPTY_FRAMES[msg_type]
+    encoded = bytes(message, "utf-8")
+    return b"".join((_PACK(1 + len(encoded)), TAGS[msg_type], encoded))
+
+
+# Control messages without payload (registrations) are always the same bytes
+_EMPTY_FRAMES = {
+    msg_type: _frame(TAGS[msg_type])
+    for msg_type in (
+        CONNECTION_END,
+        REGISTER_CLIENT,
+        REQUEST_TO_RUN,
+        REGISTER_WORKER,
+        WORK,
+        WORK_RESULT,
+        LOG,
+        WORK_RESULT_CHUNK,
+        WORK_RESULT_END,
+    )
+}
 
 
 def put_message(sock, msg_type: int, message: str):
-    put_bytes(sock, bytes([msg_type]) + bytes(message, "utf-8"))
+    sock.sendall(frame_message(msg_type, message))
+
+
+def put_messages(sock, msgs: List[Tuple[int, str]]):
+    # All frames leave in one send so that they can share a TCP segment
+    sock.sendall(
+        b"".join(frame_message(msg_type, message) for msg_type, message in msgs)
+    )
 
 
 def put(sock, message: str):
@@ -92,12 +147,50 @@ def put(sock, message: str):
 
 
 def put_bytes(sock, bytes_msg: bytes):
-    sock.send(format.pack(len(bytes_msg)) + bytes_msg)
+    sock.sendall(_frame(bytes_msg))
+
+
+def put_bytes_parts(sock, *parts: bytes):
+    # Gathered send of one frame without joining the parts in memory
+    buffers = [memoryview(_PACK(sum(len(part) for part in parts)))]
+    buffers.extend(memoryview(part) for part in parts)
+    if not hasattr(sock, "sendmsg"):  # Windows
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+
+class FrameWriter:
+    """Write-only file object that sends what is written to it as msg_type
+    frames of about RESULT_CHUNK_SIZE bytes, so that a result can be streamed
+    without knowing its length up front."""
+
+    def __init__(self, sock, msg_type: int):
+        self._sock = sock
+        self._tag = TAGS[msg_type]
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= RESULT_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            put_bytes_parts(self._sock, self._tag, self._buffer)
+            self._buffer = bytearray()
 
 
-def get_bytes(sock) -> bytes:
-    lendata = recvall(sock, format.size)
+def get_bytes(sock, buffer: Optional[bytearray] = None):
+    lendata = recvall(sock, _HDR_SIZE)
     if not lendata:
         return b""
-    (length,) = format.unpack(lendata)
-    return recvall(sock, length)
+    (length,) = _UNPACK(lendata)
+    return recvall(sock, length, buffer)
@@ -1,13 +1,68 @@
-import json
+import gzip
+import logging
+import queue
 import socket
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 import uuid
+from typing import List, Optional
 
 from . import messages
 
+LOG_BATCH_SIZE = 32 * 1024
+LOG_BATCH_SECONDS = 0.02
+RESULT_COMPRESSLEVEL = 1
+RECEIVE_BUFFER_SIZE = 64 * 1024
+OUTPUT_READ_SIZE = 64 * 1024
+
+log = logging.getLogger(__name__)
+
+
+class LogBatch:
+    """Collects console output into LOG messages of up to LOG_BATCH_SIZE
+    bytes, or whatever arrived within LOG_BATCH_SECONDS."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._deadline = 0.0
+
+    def add(self, chunk: bytes):
+        now = time.monotonic()
+        if not self._chunks:
+            self._deadline = now + LOG_BATCH_SECONDS
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size >= LOG_BATCH_SIZE or now >= self._deadline:
+            self.flush()
+
+    def timeout(self) -> Optional[float]:
+        if not self._chunks:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def flush(self):
+        if self._chunks:
+            messages.put_bytes_parts(
+                self._sock, messages.TAGS[messages.LOG], b"".join(self._chunks)
+            )
+            self._chunks = []
+            self._size = 0
+
+
+def _drain(stream, chunks: "queue.SimpleQueue[bytes]"):
+    # Output is passed on as raw bytes, whatever is available at the time
+    while "open":
+        chunk = stream.read1(OUTPUT_READ_SIZE)
+        chunks.put(chunk)
+        if not chunk:
+            return
+
 
 def working(hive_address: str):
     HOST, p = hive_address.split(":")
@@ -15,36 +70,65 @@ def working(hive_address: str):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(None)
     try:
+        messages.set_buffer_sizes(sock)
         sock.connect((HOST, PORT))
+        messages.set_nodelay(sock)
         messages.put_message(sock, messages.REGISTER_WORKER, "")
+        buffer = bytearray(RECEIVE_BUFFER_SIZE)
         while "connected":
-            msg = messages.get_message(sock)
+            msg = messages.get_message(sock, buffer)
             if msg.type == messages.CONNECTION_END:
-                print("Close signal from coordinator - closing")
+                log.info("Close signal from coordinator - closing")
                 return
-            print(f"Data {msg.data}")
             if msg.type == messages.WORK:
-                print("Received work")
+                log.debug("Received work %r", msg.data)
                 cmd = msg.data
                 with tempfile.TemporaryDirectory() as dirpath:
                     # FIXME:Actual command should be created here
                     with subprocess.Popen(
-                        cmd.replace("%OUTPUTDIR%", dirpath), shell=True
+                        cmd.replace("%OUTPUTDIR%", dirpath),
+                        shell=True,
+                        stdout=subprocess.PIPE,
+                        bufsize=OUTPUT_READ_SIZE,
                     ) as process:
-                        process.wait()
-                    with tarfile.open("TarName.tar.gz", "w:gz") as tar:
-                        tar.add(dirpath, arcname=".")
-                    with open("TarName.tar.gz", "rb") as outputs:
-                        messages.put_bytes(
-                            sock, bytes([messages.WORK_RESULT]) + outputs.read()
-                        )
+                        # Console output is shown here and passed on to the
+                        # coordinator as plain LOG messages. The pipe is
+                        # drained in its own thread so that a slow socket
+                        # never stalls the test run.
+                        chunks: "queue.SimpleQueue[bytes]" = queue.SimpleQueue()
+                        threading.Thread(
+                            target=_drain, args=(process.stdout, chunks), daemon=True
+                        ).start()
+                        batch = LogBatch(sock)
+                        while "running":
+                            try:
+                                chunk = chunks.get(timeout=batch.timeout())
+                            except queue.Empty:
+                                batch.flush()
+                                continue
+                            if not chunk:
+                                break
+                            sys.stdout.buffer.write(chunk)
+                            sys.stdout.buffer.flush()
+                            batch.add(chunk)
+                        batch.flush()
+                    # The archive is compressed straight into result chunks
+                    result = messages.FrameWriter(sock, messages.WORK_RESULT_CHUNK)
+                    with gzip.GzipFile(
+                        fileobj=result, mode="wb", compresslevel=RESULT_COMPRESSLEVEL
+                    ) as compressed:
+                        with tarfile.open(fileobj=compressed, mode="w|") as tar:
+                            tar.add(dirpath, arcname=".")
+                    result.flush()
+                    messages.put_message(sock, messages.WORK_RESULT_END, "")
             msg.flush()
     finally:
         sock.close()
-        print("Closed worker")
+        log.info("Closed worker")
 
 
 def main():
+    logging.basicConfig(level=logging.INFO)
     working(sys.argv[1])
 
 
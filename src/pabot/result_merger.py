@@ -19,6 +19,8 @@ from __future__ import absolute_import, print_function
 
 import os
 import re
+from collections import defaultdict
+from functools import lru_cache
 
 from robot import __version__ as ROBOT_VERSION
 from robot.api import ExecutionResult
@@ -33,6 +35,9 @@ except ImportError:
 
 from robot.model import SuiteVisitor
 
+# Waiting keywords of PabotLib end up in suite keywords only with Robot 3.x
+_CLEAN_WAITING_KEYWORDS = "3.0" < ROBOT_VERSION < "4.0"
+
 
 class ResultMerger(SuiteVisitor):
     def __init__(self, result, tests_root_name, out_dir, copied_artifacts, legacy_output):
@@ -40,10 +45,14 @@ class ResultMerger(SuiteVisitor):
         self.errors = result.errors
         self.current = None
         self._skip_until = None
+        self._child_index = {}
+        self._test_names = {}
         self._tests_root_name = tests_root_name
         self._prefix = ""
+        self._replacement = ""
         self._out_dir = out_dir
         self.legacy_output = legacy_output
+        self._reset_elapsed_time = ROBOT_VERSION >= "7.0" and not legacy_output
 
         self._patterns = []
         regexp_template = (
@@ -57,8 +66,8 @@ class ResultMerger(SuiteVisitor):
         try:
             self._set_prefix(merged.source)
             merged.suite.visit(self)
-            self.root.metadata.update(merged.suite.metadata)
-            if self.errors != merged.errors:
+            if merged.suite is not self.root:
+                self.root.metadata.update(merged.suite.metadata)
                 self.errors.add(merged.errors)
         except:
             print("Error while merging result %s" % merged.source)
@@ -66,9 +75,13 @@ class ResultMerger(SuiteVisitor):
 
     def _set_prefix(self, source):
         self._prefix = prefix(source)
+        # Links to copied artifacts get the prefix in front of the file name
+        self._replacement = r'\g<1>="\g<2>%s-\g<3>"' % self._prefix.replace(
+            "\\", "\\\\"
+        )
 
     def start_suite(self, suite):
-        if self._skip_until and self._skip_until != suite:
+        if self._skip_until is not None and self._skip_until is not suite:
             return
         if not self.current:
             self.current = self._find_root(suite)
@@ -76,10 +89,11 @@ class ResultMerger(SuiteVisitor):
             if self.current is not suite:
                 self._append_keywords(suite)
         else:
-            next = self._find(self.current.suites, suite)
+            next = self._find(self.current, suite)
             if next is None:
                 self.current.suites.append(suite)
                 suite.parent = self.current
+                self._children(self.current)[(suite.name, suite.source)] = suite
                 self._skip_until = suite
             else:
                 self.current = next
@@ -107,102 +121,92 @@ class ResultMerger(SuiteVisitor):
             )
         return self.root
 
-    def _find(self, items, suite):
-        name = suite.name
-        source = suite.source
-        for item in items:
-            if item.name == name and item.source == source:
-                return item
-        return None
+    def _children(self, parent):
+        # Child suites of the merged tree by (name, source), built on first use
+        index = self._child_index.get(id(parent))
+        if index is None:
+            index = self._child_index[id(parent)] = {}
+            for item in parent.suites:
+                index.setdefault((item.name, item.source), item)
+        return index
+
+    def _find(self, parent, suite):
+        return self._children(parent).get((suite.name, suite.source))
 
     def end_suite(self, suite):
-        if self._skip_until and self._skip_until != suite:
+        if self._skip_until is not None and self._skip_until is not suite:
             return
-        if self._skip_until == suite:
+        if self._skip_until is suite:
             self._skip_until = None
             return
-        self.merge_missing_tests(suite)
-        self.merge_time(suite)
-        self.clean_pabotlib_waiting_keywords(self.current)
-        self.current = self.current.parent
-
-    if ROBOT_VERSION <= "3.0" or ROBOT_VERSION >= "4.0":
-
-        def clean_pabotlib_waiting_keywords(self, suite):
-            pass
-
-    else:
-
-        def clean_pabotlib_waiting_keywords(self, suite):
-            for index, keyword in reversed(list(enumerate(suite.keywords))):
-                if (
-                    keyword.libname == "pabot.PabotLib"
-                    and keyword.kwname.startswith("Run")
-                    and len(keyword.keywords) == 0
-                ):
-                    suite.keywords.pop(index)
-
-    def merge_missing_tests(self, suite):
-        cur = self.current
-        for test in suite.tests:
-            if not any(t.longname == test.longname for t in cur.tests):
-                test.parent = cur
-                cur.tests.append(test)
-
-    def merge_time(self, suite):
         cur = self.current
-        if ROBOT_VERSION >= "7.0" and not self.legacy_output:
+        if suite is not cur:
+            # Long names of the merged suite's tests, kept over all merged outputs
+            existing = self._test_names.get(id(cur))
+            if existing is None:
+                existing = self._test_names[id(cur)] = {t.longname for t in cur.tests}
+            for test in suite.tests:
+                if test.longname not in existing:
+                    existing.add(test.longname)
+                    test.parent = cur
+                    cur.tests.append(test)
+        if self._reset_elapsed_time:
             cur.elapsed_time = None
-        cur.endtime = max([cur.endtime, suite.endtime])
-        cur.starttime = min([cur.starttime, suite.starttime])
+        # Always assigned, Robot normalizes the stored times on assignment
+        cur_end, end = cur.endtime, suite.endtime
+        cur.endtime = end if end > cur_end else cur_end
+        cur_start, start = cur.starttime, suite.starttime
+        cur.starttime = start if start < cur_start else cur_start
+        if _CLEAN_WAITING_KEYWORDS:
+            self.clean_pabotlib_waiting_keywords(cur)
+        self.current = cur.parent
+
+    def clean_pabotlib_waiting_keywords(self, suite):
+        kept = [
+            keyword
+            for keyword in suite.keywords
+            if not (
+                keyword.libname == "pabot.PabotLib"
+                and keyword.kwname.startswith("Run")
+                and len(keyword.keywords) == 0
+            )
+        ]
+        if len(kept) != len(suite.keywords):
+            suite.keywords.clear()
+            suite.keywords.extend(kept)
 
     def visit_message(self, msg):
         if not msg.html:  # no html -> no link -> no update needed
             return
+        message = msg.message
         # fix links that go outside of result directory
-        msg.message = msg.message.replace('src="../../', 'src="')
-        msg.message = msg.message.replace('href="../../', 'href="')
-        if not self._patterns:  # don't update links if no artifacts were copied
-            return
-        if not (
-            "src=" in msg.message or "href=" in msg.message
-        ):  # quick check before start search with complex regex
-            return
-
-        for pattern in self._patterns:
-            all_matches = re.finditer(pattern, msg.message)
-            offset = 0
-            prefix_str = self._prefix + "-"
-            for match in all_matches:
-                filename_start = (
-                    match.start(3) + offset
-                )  # group 3 of regexp is the file name
-                msg.message = (
-                    msg.message[:filename_start]
-                    + prefix_str
-                    + msg.message[filename_start:]
-                )
-                offset += len(
-                    prefix_str
-                )  # the string has been changed but not the original match positions
+        if '="../../' in message:
+            message = message.replace('src="../../', 'src="')
+            message = message.replace('href="../../', 'href="')
+        # update links only if artifacts were copied, quick check before
+        # starting search with complex regex
+        if self._patterns and ("src=" in message or "href=" in message):
+            for pattern in self._patterns:
+                message = pattern.sub(self._replacement, message)
+        msg.message = message
 
 
 class ResultsCombiner(CombinedResult):
     def add_result(self, other):
-        for suite in other.suite.suites:
-            self.suite.suites.append(suite)
-        self.errors.add(other.errors)
+        self.suite.suites.extend(other.suite.suites)
+        if other.errors.messages:
+            self.errors.add(other.errors)
 
 
+@lru_cache(maxsize=1024)
 def prefix(source):
-    try:
-        return os.path.split(os.path.dirname(source))[1]
-    except:
+    if not source:
         return ""
+    return os.path.basename(os.path.dirname(source))
 
 
 def group_by_root(results, critical_tags, non_critical_tags, invalid_xml_callback):
-    groups = {}
+    groups = defaultdict(list)
     for src in results:
         try:
             res = ExecutionResult(src)
@@ -213,7 +217,7 @@ def group_by_root(results, critical_tags, non_critical_tags, invalid_xml_callbac
             continue
         if ROBOT_VERSION < "4.0":
             res.suite.set_criticality(critical_tags, non_critical_tags)
-        groups[res.suite.name] = groups.get(res.suite.name, []) + [res]
+        groups[res.suite.name].append(res)
     return groups
 
 
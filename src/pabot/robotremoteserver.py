@@ -14,41 +14,33 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from __future__ import print_function
-
 import inspect
 import os
 import re
-import select
+import selectors
 import signal
+import socket
 import sys
 import threading
 import traceback
-
-if sys.version_info < (3,):
-    from collections import Mapping
-
-    from SimpleXMLRPCServer import SimpleXMLRPCServer
-    from StringIO import StringIO
-    from xmlrpclib import Binary, ServerProxy
-
-    PY2, PY3 = True, False
-else:
-    from collections.abc import Mapping
-    from io import StringIO
-    from xmlrpc.client import Binary, ServerProxy
-    from xmlrpc.server import SimpleXMLRPCServer
-
-    PY2, PY3 = False, True
-    unicode = str
-    long = int
+import types
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from socketserver import ThreadingMixIn
+from xmlrpc.client import Binary, ServerProxy
+from xmlrpc.server import SimpleXMLRPCServer
 
 
 __all__ = ["RobotRemoteServer", "stop_remote_server", "test_remote_server"]
 __version__ = "1.1.1.dev1"
 
 BINARY = re.compile("[\x00-\x08\x0B\x0C\x0E-\x1F]")
-NON_ASCII = re.compile("[\x80-\xff]")
+# Same characters as BINARY as a str.translate deletion table
+BINARY_CHARS = dict.fromkeys(c for c in range(0x20) if c not in (0x09, 0x0A, 0x0D))
+NUMBERS = frozenset((int, float, bool))
+FUNCTION_TYPES = (types.FunctionType, types.MethodType)
+LOG_LEVEL_PREFIXES = ("*TRACE*", "*DEBUG*", "*INFO*", "*HTML*", "*WARN*", "*ERROR*")
 
 
 class RobotRemoteServer(object):
@@ -83,6 +75,23 @@ class RobotRemoteServer(object):
                             ``stop_remote_server`` XML-RPC method.
         """
         self._library = RemoteLibraryFactory(library)
+        # Requests are handled in parallel but keywords run one at a time in
+        # one dedicated thread. They share the process wide standard streams,
+        # and libraries may hold resources bound to the thread that made them.
+        self._keyword_executor = ThreadPoolExecutor(max_workers=1)
+        self._keyword_names = None
+        # Keywords of the server itself, answered before asking the library
+        self._builtin_keywords = {
+            "stop_remote_server": {
+                "runner": KeywordRunner(self.stop_remote_server),
+                "arguments": [],
+                "documentation": (
+                    "Stop the remote server unless stopping is disabled.\n\n"
+                    "Return ``True/False`` depending was server stopped or not."
+                ),
+                "tags": [],
+            }
+        }
         self._server = StoppableXMLRPCServer(host, int(port))
         self._register_functions(self._server)
         self._port_file = port_file
@@ -98,6 +107,7 @@ class RobotRemoteServer(object):
         server.register_function(self.get_keyword_arguments)
         server.register_function(self.get_keyword_documentation)
         server.register_function(self.stop_remote_server)
+        server.register_multicall_functions()
 
     @property
     def server_address(self):
@@ -146,6 +156,7 @@ class RobotRemoteServer(object):
         self._announce_start(log, self._port_file)
         with SignalHandler(self.stop):
             self._server.serve()
+        self._keyword_executor.shutdown(wait=False)
         self._announce_stop(log, self._port_file)
 
     def _announce_start(self, log, port_file):
@@ -180,41 +191,78 @@ class RobotRemoteServer(object):
         return True
 
     def get_keyword_names(self):
-        return self._library.get_keyword_names() + ["stop_remote_server"]
+        if self._keyword_names is not None:
+            return self._keyword_names
+        names = self._library.get_keyword_names() + list(self._builtin_keywords)
+        # Hybrid and dynamic libraries may change their keywords at run time
+        if type(self._library) is StaticRemoteLibrary:
+            self._keyword_names = names
+        return names
 
     def run_keyword(self, name, args, kwargs=None):
-        if name == "stop_remote_server":
-            return KeywordRunner(self.stop_remote_server).run_keyword(args, kwargs)
-        return self._library.run_keyword(name, args, kwargs)
+        # Also the server's own keywords capture the standard streams, so
+        # they are run in the keyword thread too
+        builtin = self._builtin_keywords.get(name)
+        if builtin:
+            return self._keyword_executor.submit(
+                builtin["runner"].run_keyword, args, kwargs
+            ).result()
+        return self._keyword_executor.submit(
+            self._library.run_keyword, name, args, kwargs
+        ).result()
 
     def get_keyword_arguments(self, name):
-        if name == "stop_remote_server":
-            return []
+        builtin = self._builtin_keywords.get(name)
+        if builtin:
+            return builtin["arguments"]
         return self._library.get_keyword_arguments(name)
 
     def get_keyword_documentation(self, name):
-        if name == "stop_remote_server":
-            return (
-                "Stop the remote server unless stopping is disabled.\n\n"
-                "Return ``True/False`` depending was server stopped or not."
-            )
+        builtin = self._builtin_keywords.get(name)
+        if builtin:
+            return builtin["documentation"]
         return self._library.get_keyword_documentation(name)
 
     def get_keyword_tags(self, name):
-        if name == "stop_remote_server":
-            return []
+        builtin = self._builtin_keywords.get(name)
+        if builtin:
+            return builtin["tags"]
         return self._library.get_keyword_tags(name)
 
 
-class StoppableXMLRPCServer(SimpleXMLRPCServer):
+class StoppableXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
     allow_reuse_address = True
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    # Pool threads are joined at exit, so a stalled client must not keep
+    # one blocked forever. Keywords may still run longer than this.
+    request_timeout = 60
 
     def __init__(self, host, port):
+        # Binary arguments are unmarshalled straight to bytes
         SimpleXMLRPCServer.__init__(
-            self, (host, port), logRequests=False, bind_and_activate=False
+            self,
+            (host, port),
+            logRequests=False,
+            bind_and_activate=False,
+            use_builtin_types=True,
         )
         self._activated = False
-        self._stopper_thread = None
+        self._stopped = threading.Event()
+        # stop() writes to this pair to wake serve() up at once
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_writer.setblocking(False)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def process_request(self, request, client_address):
+        # A fixed pool instead of ThreadingMixIn's thread per request
+        request.settimeout(self.request_timeout)
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        SimpleXMLRPCServer.server_close(self)
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        self._pool.shutdown(wait=False)
 
     def activate(self):
         if not self._activated:
@@ -225,21 +273,23 @@ class StoppableXMLRPCServer(SimpleXMLRPCServer):
 
     def serve(self):
         self.activate()
-        try:
-            self.serve_forever()
-        except select.error:
-            # Signals seem to cause this error with Python 2.6.
-            if sys.version_info[:2] > (2, 6):
-                raise
+        # No polling interval, stop() always wakes the selector up
+        with selectors.DefaultSelector() as selector:
+            selector.register(self, selectors.EVENT_READ)
+            selector.register(self._wakeup_reader, selectors.EVENT_READ)
+            while not self._stopped.is_set():
+                for key, _ in selector.select():
+                    if key.fileobj is self:
+                        self._handle_request_noblock()
         self.server_close()
-        if self._stopper_thread:
-            self._stopper_thread.join()
-            self._stopper_thread = None
 
     def stop(self):
-        self._stopper_thread = threading.Thread(target=self.shutdown)
-        self._stopper_thread.daemon = True
-        self._stopper_thread.start()
+        # Safe from any thread, including a signal handler interrupting serve()
+        self._stopped.set()
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # Already woken up or closed
 
 
 class SignalHandler(object):
@@ -285,7 +335,7 @@ def dynamic_method(library, underscore_name):
 
 
 def is_function_or_method(item):
-    return inspect.isfunction(item) or inspect.ismethod(item)
+    return isinstance(item, FUNCTION_TYPES)
 
 
 class StaticRemoteLibrary(object):
@@ -293,11 +343,17 @@ class StaticRemoteLibrary(object):
         self._library = library
         self._names = None
         self._robot_name_index = None
+        # Keyword metadata does not change, so reflection is done once
+        self._keywords = {}
+        self._arguments = {}
+        self._documentation = {}
+        self._tags = {}
 
     def _construct_keyword_names(self):
         names = []
         robot_name_index = {}
-        for name, kw in inspect.getmembers(self._library):
+        for name in self._function_names():
+            kw = getattr(self._library, name, None)
             if is_function_or_method(kw):
                 if getattr(kw, "robot_name", None):
                     names.append(kw.robot_name)
@@ -306,6 +362,28 @@ class StaticRemoteLibrary(object):
                     names.append(name)
         return names, robot_name_index
 
+    def _function_names(self):
+        # Only attributes holding functions are looked up, so properties and
+        # other descriptors of the library are never triggered
+        library = self._library
+        if inspect.ismodule(library):
+            namespaces = [vars(library)]
+        elif inspect.isclass(library):
+            namespaces = [vars(cls) for cls in library.__mro__]
+        else:
+            namespaces = [vars(cls) for cls in type(library).__mro__]
+            namespaces.insert(0, getattr(library, "__dict__", {}))
+        seen = set()
+        for namespace in namespaces:
+            for name, value in list(namespace.items()):
+                if name in seen:
+                    continue
+                seen.add(name)
+                if is_function_or_method(value) or isinstance(
+                    value, (staticmethod, classmethod)
+                ):
+                    yield name
+
     def get_keyword_names(self):
         if self._names is None:
             self._names, self._robot_name_index = self._construct_keyword_names()
@@ -316,17 +394,24 @@ class StaticRemoteLibrary(object):
         return KeywordRunner(kw).run_keyword(args, kwargs)
 
     def _get_keyword(self, name):
+        if name in self._keywords:
+            return self._keywords[name]
         if self._names is None:
             self._names, self._robot_name_index = self._construct_keyword_names()
-        if name in self._robot_name_index:
-            name = self._robot_name_index[name]
-        return getattr(self._library, name)
+        kw = getattr(self._library, self._robot_name_index.get(name, name))
+        self._keywords[name] = kw
+        return kw
 
     def get_keyword_arguments(self, name):
+        if name not in self._arguments:
+            self._arguments[name] = self._get_keyword_arguments(name)
+        return self._arguments[name]
+
+    def _get_keyword_arguments(self, name):
         if __name__ == "__init__":
             return []
         kw = self._get_keyword(name)
-        args, varargs, kwargs, defaults = inspect.getfullargspec(kw)
+        args, varargs, kwargs, defaults = inspect.getfullargspec(kw)[:4]
         if inspect.ismethod(kw):
             args = args[1:]  # drop 'self'
         if defaults:
@@ -339,13 +424,15 @@ class StaticRemoteLibrary(object):
         return args
 
     def get_keyword_documentation(self, name):
-        if name == "__intro__":
-            source = self._library
-        elif name == "__init__":
-            source = self._get_init(self._library)
-        else:
-            source = self._get_keyword(name)
-        return inspect.getdoc(source) or ""
+        if name not in self._documentation:
+            if name == "__intro__":
+                source = self._library
+            elif name == "__init__":
+                source = self._get_init(self._library)
+            else:
+                source = self._get_keyword(name)
+            self._documentation[name] = inspect.getdoc(source) or ""
+        return self._documentation[name]
 
     def _get_init(self, library):
         if inspect.ismodule(library):
@@ -358,14 +445,14 @@ class StaticRemoteLibrary(object):
             return False
         # https://bitbucket.org/pypy/pypy/issues/2462/
         if "PyPy" in sys.version:
-            if PY2:
-                return init.__func__ is not object.__init__.__func__
             return init is not object.__init__
         return is_function_or_method(init)
 
     def get_keyword_tags(self, name):
-        keyword = self._get_keyword(name)
-        return getattr(keyword, "robot_tags", [])
+        if name not in self._tags:
+            keyword = self._get_keyword(name)
+            self._tags[name] = getattr(keyword, "robot_tags", [])
+        return self._tags[name]
 
 
 class HybridRemoteLibrary(StaticRemoteLibrary):
@@ -386,8 +473,11 @@ class DynamicRemoteLibrary(HybridRemoteLibrary):
         self._get_keyword_tags = dynamic_method(library, "get_keyword_tags")
 
     def _get_kwargs_support(self, run_keyword):
-        spec = inspect.getfullargspec(run_keyword)
-        return len(spec.args) > 3  # self, name, args, kwargs=None
+        # self, name, args, kwargs=None
+        code = getattr(run_keyword, "__code__", None)
+        if code is not None:
+            return code.co_argcount > 3
+        return len(inspect.getfullargspec(run_keyword).args) > 3
 
     def run_keyword(self, name, args, kwargs=None):
         args = [name, args, kwargs] if kwargs else [name, args, {}]
@@ -416,8 +506,7 @@ class KeywordRunner(object):
         self._keyword = keyword
 
     def run_keyword(self, args, kwargs=None):
-        args = self._handle_binary(args)
-        kwargs = self._handle_binary(kwargs or {})
+        kwargs = kwargs or {}
         result = KeywordResult()
         with StandardStreamInterceptor() as interceptor:
             try:
@@ -434,18 +523,6 @@ class KeywordRunner(object):
         result.set_output(interceptor.output)
         return result.data
 
-    def _handle_binary(self, arg):
-        # No need to compare against other iterables or mappings because we
-        # only get actual lists and dicts over XML-RPC. Binary cannot be
-        # a dictionary key either.
-        if isinstance(arg, list):
-            return [self._handle_binary(item) for item in arg]
-        if isinstance(arg, dict):
-            return dict((key, self._handle_binary(arg[key])) for key in arg)
-        if isinstance(arg, Binary):
-            return arg.data
-        return arg
-
 
 class StandardStreamInterceptor(object):
     def __init__(self):
@@ -467,9 +544,8 @@ class StandardStreamInterceptor(object):
         for stream in close:
             stream.close()
         if stdout and stderr:
-            if not stderr.startswith(
-                ("*TRACE*", "*DEBUG*", "*INFO*", "*HTML*", "*WARN*", "*ERROR*")
-            ):
+            # All level prefixes start with "*", most plain output does not
+            if stderr[0] != "*" or not stderr.startswith(LOG_LEVEL_PREFIXES):
                 stderr = "*INFO* %s" % stderr
             if not stdout.endswith("\n"):
                 stdout += "\n"
@@ -507,15 +583,14 @@ class KeywordResult(object):
     def _get_message_from_exception(self, value):
         # UnicodeError occurs if message contains non-ASCII bytes
         try:
-            msg = unicode(value)
+            msg = str(value)
         except UnicodeError:
             msg = " ".join(self._str(a, handle_binary=False) for a in value.args)
         return self._handle_binary_result(msg)
 
     def _get_traceback(self, exc_tb):
-        # Latest entry originates from this module so it can be removed
-        entries = traceback.extract_tb(exc_tb)[1:]
-        trace = "".join(traceback.format_list(entries))
+        # Latest entry originates from this module so it is skipped
+        trace = "".join(traceback.format_tb(exc_tb.tb_next))
         return "Traceback (most recent call last):\n" + trace
 
     def _get_error_attribute(self, exc_value, name):
@@ -527,10 +602,16 @@ class KeywordResult(object):
             self.data["return"] = value
 
     def _handle_return_value(self, ret):
-        if isinstance(ret, (str, unicode, bytes)):
+        if isinstance(ret, (str, bytes)):
             return self._handle_binary_result(ret)
-        if isinstance(ret, (int, long, float)):
+        if isinstance(ret, (int, float)):
             return ret
+        if ret is None:
+            return ""
+        if isinstance(ret, (list, tuple)):
+            # Numbers need no handling, skip the call for them
+            handle = self._handle_return_value
+            return [item if type(item) in NUMBERS else handle(item) for item in ret]
         if isinstance(ret, Mapping):
             return dict(
                 (self._str(key), self._handle_return_value(value))
@@ -549,25 +630,22 @@ class KeywordResult(object):
                 result = result.encode("ASCII")
             except UnicodeError:
                 raise ValueError("Cannot represent %r as binary." % result)
-        # With IronPython Binary cannot be sent if it contains "real" bytes.
-        if sys.platform == "cli":
-            result = str(result)
         return Binary(result)
 
     def _contains_binary(self, result):
-        if PY3:
-            return isinstance(result, bytes) or BINARY.search(result)
-        return (
-            isinstance(result, bytes)
-            and NON_ASCII.search(result)
-            or BINARY.search(result)
-        )
+        if isinstance(result, bytes):
+            return True
+        # Deleting is a plain C loop for ASCII text, much faster than the
+        # regex on long outputs. For other text the regex is faster.
+        if len(result) > 1024 and getattr(result, "isascii", bool)():
+            return len(result.translate(BINARY_CHARS)) != len(result)
+        return BINARY.search(result)
 
     def _str(self, item, handle_binary=True):
         if item is None:
             return ""
-        if not isinstance(item, (str, unicode, bytes)):
-            item = unicode(item)
+        if not isinstance(item, (str, bytes)):
+            item = str(item)
         if handle_binary:
             item = self._handle_binary_result(item)
         return item
@@ -588,15 +666,21 @@ def test_remote_server(uri, log=True):
     :return      ``True`` if server is running, ``False`` otherwise.
     """
     logger = print if log else lambda message: None
-    try:
-        ServerProxy(uri).get_keyword_names()
-    except Exception:
+    if not _is_running(ServerProxy(uri)):
         logger("No remote server running at %s." % uri)
         return False
     logger("Remote server running at %s." % uri)
     return True
 
 
+def _is_running(proxy):
+    try:
+        proxy.get_keyword_names()
+    except Exception:
+        return False
+    return True
+
+
 def stop_remote_server(uri, log=True):
     """Stop remote server unless server has disabled stopping.
 
@@ -606,11 +690,13 @@ def stop_remote_server(uri, log=True):
                  the first place, ``False`` otherwise.
     """
     logger = print if log else lambda message: None
-    if not test_remote_server(uri, log=False):
+    # One proxy, and so one transport, for both calls
+    proxy = ServerProxy(uri)
+    if not _is_running(proxy):
         logger("No remote server running at %s." % uri)
         return True
     logger("Stopping remote server at %s." % uri)
-    if not ServerProxy(uri).stop_remote_server():
+    if not proxy.stop_remote_server():
         logger("Stopping not allowed!")
         return False
     return True
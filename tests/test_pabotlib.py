@@ -54,6 +54,25 @@ class PabotLibTests(unittest.TestCase):
         self.assertEqual(lib._path, "")
         lib._close()
 
+    def test_pabotlib_listener_path_with_nested_keywords(self):
+        lib = pabotlib.PabotLib()
+        lib._start_suite("Suite", {"longname": "Suite"})
+        lib._start_test("Test", {"longname": "Suite.Test"})
+        lib._start_keyword("Keyword1", {})
+        lib._start_keyword("Inner1", {})
+        self.assertEqual(lib._path, "Suite.Test.0.0")
+        lib._end_keyword("Inner1", {})
+        lib._start_keyword("Inner2", {})
+        self.assertEqual(lib._path, "Suite.Test.0.1")
+        lib._end_keyword("Inner2", {})
+        self.assertEqual(lib._path, "Suite.Test.0")
+        lib._end_keyword("Keyword1", {})
+        lib._start_keyword("Keyword2", {})
+        self.assertEqual(lib._path, "Suite.Test.1")
+        lib._end_keyword("Keyword2", {})
+        self.assertEqual(lib._path, "Suite.Test")
+        lib._close()
+
     def test_pabotlib_listener_when_dynamic_import_with_import_library(self):
         lib = pabotlib.PabotLib()
         lib._end_keyword("Import Library", {})
@@ -133,6 +152,27 @@ class PabotLibTests(unittest.TestCase):
         lib.run_only_once("keyword")
         self.assertEqual(self._runs, 1)
 
+    def test_pabotlib_run_setup_only_once(self):
+        lib = pabotlib.PabotLib()
+        lib._start_suite("Suite", {"longname": "Suite"})
+        lib.run_setup_only_once("keyword")
+        lib.run_setup_only_once("keyword")
+        self.assertEqual(self._runs, 1)
+        self.assertEqual(lib._locks, {})
+
+    def test_pabotlib_run_only_once_failure_is_shared(self):
+        lib = pabotlib.PabotLib()
+
+        def failing(*args):
+            raise AssertionError("failed")
+
+        self.builtinmock.run_keyword = failing
+        with self.assertRaisesRegex(AssertionError, "^failed$"):
+            lib.run_only_once("keyword")
+        with self.assertRaisesRegex(AssertionError, "other process"):
+            lib.run_only_once("keyword")
+        self.assertEqual(lib._locks, {})
+
     def test_pabotlib_run_on_last_process(self):
         lib = pabotlib.PabotLib()
         self.assertEqual(self._runs, 0)
@@ -150,6 +190,13 @@ class PabotLibTests(unittest.TestCase):
         lib.run_on_last_process("keyword")
         self.assertEqual(self._runs, 1)
 
+    def test_polling_intervals_back_off_up_to_max(self):
+        intervals = pabotlib._polling_intervals(0.1)
+        self.assertEqual(
+            [next(intervals) for _ in range(7)],
+            [0.005, 0.01, 0.02, 0.04, 0.08, 0.1, 0.1],
+        )
+
     def test_acquire_and_release_lock(self):
         lib = pabotlib.PabotLib()
         self.assertTrue(lib.acquire_lock("lockname"))
@@ -206,6 +253,25 @@ class PabotLibTests(unittest.TestCase):
         self.assertNotEqual(vals, vals2)
         lib.release_value_set()
 
+    def test_parsed_valuesets_are_not_shared_between_libraries(self):
+        resourcefile = os.path.join("tests", "resourcefile.dat")
+        lib = pabotlib.PabotLib()
+        lib._values = lib._parse_values(resourcefile=resourcefile)
+        other = pabotlib.PabotLib()
+        other._values = other._parse_values(resourcefile=resourcefile)
+        self.assertEqual(
+            lib._values["TestSystemWithLasers"]["tags"], ("laser", "commontag")
+        )
+        lib.acquire_value_set("laser")
+        lib.disable_value_set()
+        self.assertNotIn("TestSystemWithLasers", lib._values)
+        self.assertIn("TestSystemWithLasers", other._values)
+        lib._values["MyValueSet"]["key"] = "changed"
+        self.assertNotEqual(other._values["MyValueSet"]["key"], "changed")
+        third = pabotlib.PabotLib()
+        third._values = third._parse_values(resourcefile=resourcefile)
+        self.assertNotEqual(third._values["MyValueSet"]["key"], "changed")
+
     def test_add_to_valueset(self):
         lib = pabotlib.PabotLib()
         my_value_set_1 = {"key": "someVal1", "tags": "valueset1,common"}
@@ -222,6 +288,14 @@ class PabotLibTests(unittest.TestCase):
         self.assertEqual("someVal2", lib.get_value_from_set("key"))
         lib.release_value_set()
 
+    def test_added_valueset_keys_are_case_insensitive(self):
+        lib = pabotlib.PabotLib()
+        lib.add_value_to_set("MyValueSet", {"MyKey": "someVal", "Tags": "mine"})
+        lib.acquire_value_set("mine")
+        self.assertEqual("someVal", lib.get_value_from_set("mykey"))
+        self.assertEqual("someVal", lib.get_value_from_set("MYKEY"))
+        lib.release_value_set()
+
     def test_ignore_execution_will_not_run_special_keywords_after(self):
         lib = pabotlib.PabotLib()
         try:
@@ -64,6 +64,7 @@ class ResultMergerTests(unittest.TestCase):
         )
         self.assertEqual(result_merger.prefix(os.path.join("koo", "foo.bar")), "koo")
         self.assertEqual(result_merger.prefix("hui.txt"), "")
+        self.assertEqual(result_merger.prefix(None), "")
 
     def test_elapsed_time(self):
         # output.xml generated based on robotframework >= 7.0 without --legacyoutput option